@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 配置：使用 gevent worker，以协程承载大量 SSE 长连接。
+
+任务进度队列保存在进程内存中（/start 与 /progress 必须落在同一进程），
+因此默认只启动 1 个 worker，靠 worker_connections 扩展并发连接数。
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+worker_class = "gevent"
+workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+worker_connections = 1000
+timeout = 120
@@ -7,27 +7,43 @@ img_downloader_web_zip_only.py
 - 访问 /login 登录后，才能使用下载页面（/）。
 - 账号密码从环境变量读取：
   - APP_USERNAME
-  - APP_PASSWORD
+  - APP_PASSWORD（或 APP_PASSWORD_HASH：密码的 SHA-256 十六进制）
 - 文件下载逻辑与原版一致：
   - 前端粘贴多行 URL
   - 后端为每个任务生成 UUID task_id
   - 每张图片下载 + 打包 ZIP
   - 提供 SSE 进度 /progress/<task_id>
   - 提供下载 /download_final/<task_id>
+- 部署在 nginx 后面时可设置 USE_XACCEL=1，由 nginx 直接发送 ZIP 文件：
+    location /_protected_zips/ {
+        internal;
+        alias /path/to/tmp_zip/;   # 与 TMP_DIR 一致
+    }
 """
 
 import os
-import re
+
+# 在 gevent 下运行时，必须在导入其它模块之前完成 monkey patch
+if os.environ.get("GEVENT") == "1":
+    from gevent import monkey
+    monkey.patch_all()
+
+import hmac
+import hashlib
+import asyncio
 import time
 import uuid
-import json
+import heapq
 import queue
+import functools
+import itertools
 import threading
 import urllib.parse
 from io import BytesIO
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile
 
-import requests
+import aiohttp
+import orjson
 from flask import (
     Flask,
     render_template_string,
@@ -44,13 +60,36 @@ from flask import (
 # 临时 zip 存放目录，可以用环境变量 TMP_DIR 覆盖（在 Zeabur 上可以挂到 /data/tmp_zip）
 TMP_DIR = os.environ.get("TMP_DIR", "tmp_zip")
 ZIP_TTL_SECONDS = 3600       # ZIP 存放时间（秒），超过将被后台清理
-CLEANUP_INTERVAL = 600       # 清理线程间隔（秒）
-DOWNLOAD_TIMEOUT = 20        # requests 超时时间（秒）
-CHUNK_SIZE = 1024            # 下载分块大小（字节）
+CLEANUP_INTERVAL = 3600      # 兜底全量扫描间隔（秒），正常过期由过期堆按时删除
+TASK_QUEUE_TTL_SECONDS = 60  # 任务完成后保留进度队列的时间（秒），供前端读完剩余消息
+PROGRESS_QUEUE_MAXSIZE = 1024  # 单个任务进度队列的最小长度（URL 较多时按数量放大）
+# 同时存在的任务数上限，超过时 /start 返回 503
+MAX_ACTIVE_TASKS = int(os.environ.get("MAX_ACTIVE_TASKS", "64"))
+DOWNLOAD_TIMEOUT = 20        # 连接/读取超时时间（秒）
+CHUNK_SIZE = 64 * 1024       # 下载分块大小（字节）
+HTTP_POOL_SIZE = 32          # 共享 HTTP 连接池大小（keep-alive 复用）
+SSE_FLUSH_INTERVAL = 0.1     # SSE 合并推送间隔（秒），约 10 Hz
+SSE_KEEPALIVE_SECONDS = 15   # SSE 空闲保活间隔（秒）
+# 设置 USE_XACCEL=1 时由 nginx 发送 ZIP（X-Accel-Redirect），需要配置：
+#   location /_protected_zips/ { internal; alias /path/to/tmp_zip/; }
+USE_XACCEL = os.environ.get("USE_XACCEL") == "1"
+XACCEL_PREFIX = os.environ.get("XACCEL_PREFIX", "/_protected_zips/")
+# 打包时值得压缩的扩展名（其余图片格式本身已压缩，直接存储）
+COMPRESSIBLE_EXTS = {".svg", ".bmp", ".txt"}
+# 单张图片允许的最大字节数，超过则该图片下载失败
+MAX_IMAGE_BYTES = int(os.environ.get("MAX_IMAGE_BYTES", str(100 * 1024 * 1024)))
+# 单个任务内同时下载的图片数量
+MAX_CONCURRENT_DOWNLOADS = max(1, int(os.environ.get("MAX_CONCURRENT_DOWNLOADS", "8")))
 
 # 登录账号密码（在 Zeabur 环境变量设置）
 APP_USERNAME = os.environ.get("APP_USERNAME", "admin")
 APP_PASSWORD = os.environ.get("APP_PASSWORD", "password")
+# 也可以直接设置 APP_PASSWORD_HASH（密码的 SHA-256 十六进制），避免在环境变量中保存明文
+_PW_HASH = (
+    bytes.fromhex(os.environ["APP_PASSWORD_HASH"])
+    if os.environ.get("APP_PASSWORD_HASH")
+    else hashlib.sha256(APP_PASSWORD.encode("utf-8")).digest()
+)
 
 os.makedirs(TMP_DIR, exist_ok=True)
 
@@ -62,18 +101,27 @@ app.secret_key = os.environ.get("SECRET_KEY", "CHANGE_ME_SECRET_KEY")
 # task_id -> queue.Queue()（用于 SSE 推送进度）
 progress_queues = {}
 
+# 过期最小堆：(expire_at, seq, callback)，由清理线程在 Condition 上等待最近的过期时间
+_expiry_heap = []
+_expiry_seq = itertools.count()
+_expiry_cv = threading.Condition()
+
 # ====== 辅助函数 ======
-_filename_sanitize_re = re.compile(r'[^A-Za-z0-9._\-]')
+# 256 项的字节映射表：A-Za-z0-9 . _ - 保持不变，其余全部映射为 "_"
+_SAFE_FILENAME_CHARS = b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789._-"
+_SANITIZE_TABLE = bytes(b if b in _SAFE_FILENAME_CHARS else ord("_") for b in range(256))
 
 def sanitize_filename(name: str, max_len: int = 200) -> str:
     """将文件名中不安全字符替换为下划线，并限制长度。"""
     if not name:
         name = "file"
-    name = _filename_sanitize_re.sub("_", name)
+    # 非 ASCII 字符先按码点替换为 "?"，再由 bytes.translate 在 C 层一次完成映射
+    name = name.encode("ascii", "replace").translate(_SANITIZE_TABLE).decode("ascii")
     if len(name) > max_len:
         name = name[:max_len]
     return name
 
+@functools.lru_cache(maxsize=4096)
 def extract_filename_from_url(url: str) -> str:
     """
     从 URL 中提取文件名：
@@ -81,6 +129,7 @@ def extract_filename_from_url(url: str) -> str:
     - 取 path 的 basename
     - 若没有扩展名则追加 .jpg
     - 对结果做 sanitize
+    纯函数，结果按 URL 缓存（粘贴列表中重复的 URL 很常见）。
     """
     try:
         clean = url.split("?", 1)[0]
@@ -95,6 +144,12 @@ def extract_filename_from_url(url: str) -> str:
     except Exception:
         return sanitize_filename("file.jpg")
 
+def _static_html(body: bytes) -> Response:
+    """返回预先渲染好的 HTML 页面。"""
+    resp = Response(body, mimetype="text/html")
+    resp.headers["Cache-Control"] = "private, max-age=60"
+    return resp
+
 # ====== 登录相关 ======
 def is_logged_in() -> bool:
     return bool(session.get("logged_in"))
@@ -154,14 +209,23 @@ button:hover{background:#0069d9}
 </html>
 """
 
+# 无错误、next="/" 的登录页在导入时预先渲染，最常见的 GET /login 直接返回
+with app.app_context():
+    _LOGIN_OK_BYTES = render_template_string(LOGIN_PAGE, error=None, next_path="/").encode("utf-8")
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     error = None
     next_path = request.args.get("next") or request.form.get("next") or "/"
+    if request.method == "GET" and next_path == "/":
+        return _static_html(_LOGIN_OK_BYTES)
     if request.method == "POST":
         username = request.form.get("username", "").strip()
         password = request.form.get("password", "").strip()
-        if username == APP_USERNAME and password == APP_PASSWORD:
+        # 常量时间比较，避免按字节短路带来的时间侧信道
+        pw_ok = hmac.compare_digest(hashlib.sha256(password.encode("utf-8")).digest(), _PW_HASH)
+        user_ok = hmac.compare_digest(username.encode("utf-8"), APP_USERNAME.encode("utf-8"))
+        if pw_ok and user_ok:
             session["logged_in"] = True
             return redirect(next_path or "/")
         else:
@@ -173,76 +237,239 @@ def logout():
     session.clear()
     return redirect(url_for("login"))
 
-# ====== 下载工作线程 ======
-def download_worker(urls, q: queue.Queue, task_id: str):
+# ====== 进度队列 ======
+def _is_terminal_status(status: str) -> bool:
+    return status.startswith("完成") or status.startswith("失败")
+
+def put_progress(q: queue.Queue, msg: dict):
+    """
+    非阻塞地写入进度消息。队列满（前端迟迟未连接 SSE）时先把同一 idx 的旧 update
+    合并为最新一条；仍然满则丢弃最旧的非终态 update。init/done 以及带有
+    完成/失败状态的 update 永远不会被丢弃（/start 按 URL 数量设置了足够的队列长度）。
+    """
+    while True:
+        try:
+            q.put_nowait(msg)
+            return
+        except queue.Full:
+            pass
+        with q.mutex:
+            latest = {}
+            for old in q.queue:
+                if old.get("type") == "update":
+                    latest[old["idx"]] = old
+            kept = [old for old in q.queue if old.get("type") != "update" or latest[old["idx"]] is old]
+            if len(kept) >= q.maxsize:
+                for i, old in enumerate(kept):
+                    if old.get("type") == "update" and not _is_terminal_status(old["status"]):
+                        del kept[i]
+                        break
+                else:
+                    # 队列中没有可丢弃的 update，直接追加
+                    q.queue.append(msg)
+                    q.unfinished_tasks += 1
+                    q.not_empty.notify()
+                    return
+            q.queue.clear()
+            q.queue.extend(kept)
+
+# ====== 后台下载事件循环 ======
+# 所有下载任务共用一个事件循环线程，由 asyncio 在单线程内复用大量 socket
+_download_loop = asyncio.new_event_loop()
+threading.Thread(target=_download_loop.run_forever, daemon=True).start()
+
+# 所有任务共用的 HTTP 会话，跨 URL / 跨任务复用 keep-alive 连接与 TLS 握手
+_http_session = None
+
+async def _get_http_session() -> aiohttp.ClientSession:
+    """在下载事件循环内懒加载共享的 ClientSession（只会在该循环线程中调用）。"""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        # 只复用连接，不在任务之间保留 Cookie（与原先每次独立请求的行为一致）
+        _http_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE),
+            cookie_jar=aiohttp.DummyCookieJar(),
+        )
+    return _http_session
+
+# ====== 下载协程 ======
+async def _download_worker_async(urls, q: queue.Queue, task_id: str):
     """
-    异步下载所有 URL，实时将 items（每张图片的 name/status/progress）放入队列推送给前端。
-    最后在 tmp_zip/<task_id>.zip 写入打包结果并发送 done=True。
+    下载任务入口：调用 _download_to_zip 完成下载与打包，并保证无论成功与否都会
+    - 删除残留的 .part 文件
+    - 发送结束消息 {"type": "done"}（异常中止时附带 "error"）
+    - 到期回收该任务的进度队列（否则 SSE 会一直等待，且一直占用 MAX_ACTIVE_TASKS 名额）
+    """
+    zip_path = os.path.join(TMP_DIR, f"{task_id}.zip")
+    tmp_path = zip_path + ".part"
+    error = "任务异常中止"
+    try:
+        await _download_to_zip(urls, q, tmp_path)
+        os.replace(tmp_path, zip_path)
+        schedule_expiry(ZIP_TTL_SECONDS, functools.partial(_remove_file, zip_path))
+        error = None
+    except Exception as e:
+        error = f"打包失败: {str(e)}"
+        raise
+    finally:
+        _remove_file(tmp_path)
+        done = {"type": "done"}
+        if error:
+            done["error"] = error
+        put_progress(q, done)
+        # 在前端读完剩余消息后回收该任务的队列
+        schedule_expiry(TASK_QUEUE_TTL_SECONDS, functools.partial(progress_queues.pop, task_id, None))
+
+async def _download_to_zip(urls, q: queue.Queue, tmp_path: str):
+    """
+    使用 aiohttp 并发下载所有 URL 并写入 tmp_path 处的 ZIP，通过队列向前端推送增量进度：
+    - 开始时发送一次 {"type": "init", "items": [...]}（全部文件名/状态/进度）
+    - 之后只发送 {"type": "update", "idx": i, "progress": p, "status": s}
     """
     items = []  # 每个元素: {"name": filename, "status": "...", "progress": 0..100}
-    zip_buffer = BytesIO()
 
-    with ZipFile(zip_buffer, "w") as zf:
-        for i, url in enumerate(urls, start=1):
-            filename = extract_filename_from_url(url)
-            # 如果有重复名字，添加序号避免覆盖
+    # 预先计算全部文件名（重复名字添加序号避免覆盖）
+    used_names = set()
+    name_counters = {}  # filename -> 已使用的最大序号
+    for url in urls:
+        filename = extract_filename_from_url(url)
+        unique_name = filename
+        if filename in used_names:
             base, ext = os.path.splitext(filename)
-            unique_name = filename
-            suffix = 1
-            while any(it["name"] == unique_name for it in items):
-                unique_name = f"{base}_{suffix}{ext}"
+            suffix = name_counters.get(filename, 0)
+            while unique_name in used_names:
                 suffix += 1
-
-            item = {"name": unique_name, "status": "下载中", "progress": 0}
-            items.append(item)
-            q.put({"items": items.copy(), "done": False})
-
+                unique_name = f"{base}_{suffix}{ext}"
+            name_counters[filename] = suffix
+        used_names.add(unique_name)
+        items.append({"name": unique_name, "status": "等待中", "progress": 0})
+
+    put_progress(q, {"type": "init", "items": [dict(it) for it in items]})
+
+    def push_update(idx: int):
+        item = items[idx]
+        put_progress(q, {"type": "update", "idx": idx, "progress": item["progress"], "status": item["status"]})
+
+    # 单个任务内同时下载的数量上限
+    limiter = asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS)
+    # ZIP 按输入顺序写入，已下载但尚未轮到写入的结果需暂存在内存中。
+    # 只为 idx < next_write + reorder_window 的条目创建下载任务，
+    # 使暂存量最多为 reorder_window 张图片（每张不超过 MAX_IMAGE_BYTES）
+    reorder_window = 2 * MAX_CONCURRENT_DOWNLOADS
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=DOWNLOAD_TIMEOUT, sock_read=DOWNLOAD_TIMEOUT)
+
+    async def _fetch(session: aiohttp.ClientSession, url: str, idx: int):
+        """下载单个 URL，返回 (idx, unique_name, BytesIO 或 Exception)。"""
+        item = items[idx]
+        async with limiter:
+            item["status"] = "下载中"
+            push_update(idx)
+            last_pushed_progress = 0
             try:
-                # stream 下载以便计算进度
-                with requests.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
-                    r.raise_for_status()
-                    total = int(r.headers.get("content-length") or 0)
+                # 流式读取以便计算进度
+                async with session.get(url, timeout=timeout) as resp:
+                    resp.raise_for_status()
+                    total = resp.content_length or 0
+                    # 声明的大小超过上限时直接拒绝，不开始读取
+                    if total and total > MAX_IMAGE_BYTES:
+                        raise ValueError(f"文件过大: {total} 字节")
                     downloaded = 0
-                    chunks = []
-                    for chunk in r.iter_content(chunk_size=CHUNK_SIZE):
-                        if not chunk:
-                            continue
-                        chunks.append(chunk)
+                    # 分块直接写入单个缓冲区，省去 chunks 列表和 b"".join 的额外拷贝
+                    buf = BytesIO()
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
                         downloaded += len(chunk)
+                        # 未声明或声明不实的大小在读取过程中同样受上限约束
+                        if downloaded > MAX_IMAGE_BYTES:
+                            raise ValueError(f"文件过大: 超过 {MAX_IMAGE_BYTES} 字节")
+                        buf.write(chunk)
                         if total:
-                            item["progress"] = int(downloaded * 100 / total)
+                            item["progress"] = min(int(downloaded * 100 / total), 100)
                         else:
                             item["progress"] = 100  # 无 content-length 的情况下直接置 100
-                        # 推送当前状态（浅拷贝）
-                        q.put({"items": items.copy(), "done": False})
-
-                    content_bytes = b"".join(chunks)
+                        # 进度至少前进 1% 才推送，避免每个分块都入队
+                        if item["progress"] - last_pushed_progress >= 1:
+                            last_pushed_progress = item["progress"]
+                            push_update(idx)
 
-                # 写入 ZIP（使用 unique_name）
-                zf.writestr(unique_name, content_bytes)
-                item["status"] = "完成"
-                item["progress"] = 100
-                q.put({"items": items.copy(), "done": False})
-
-            except requests.exceptions.RequestException as e:
-                item["status"] = f"失败: {str(e)}"
-                item["progress"] = 100
-                q.put({"items": items.copy(), "done": False})
+                    return idx, item["name"], buf
             except Exception as e:
-                item["status"] = f"失败: {str(e)}"
-                item["progress"] = 100
-                q.put({"items": items.copy(), "done": False})
+                return idx, item["name"], e
 
-    # 写入磁盘
-    zip_buffer.seek(0)
-    zip_path = os.path.join(TMP_DIR, f"{task_id}.zip")
-    with open(zip_path, "wb") as f:
-        f.write(zip_buffer.read())
+    def write_entry(zf: ZipFile, idx: int, buf: BytesIO):
+        item = items[idx]
+        unique_name = item["name"]
+        try:
+            # 直接写入缓冲区视图（使用 unique_name），不再生成完整的 bytes 副本
+            with buf.getbuffer() as data:
+                if os.path.splitext(unique_name)[1].lower() in COMPRESSIBLE_EXTS:
+                    zf.writestr(unique_name, data, compress_type=ZIP_DEFLATED, compresslevel=1)
+                else:
+                    zf.writestr(unique_name, data)
+            item["status"] = "完成"
+        except Exception as e:
+            item["status"] = f"失败: {str(e)}"
+        item["progress"] = 100
+        push_update(idx)
+
+    # 默认 ZIP_STORED：JPEG/PNG/WEBP 已经是压缩格式，再压缩几乎没有收益却很耗 CPU
+    # 下载协程只负责取数据，写入 ZIP 统一在当前协程中进行
+    # 直接写入磁盘上的临时文件（不在内存中缓存整个 ZIP），完成后由调用方原子重命名
+    session = await _get_http_session()
+    with open(tmp_path, "wb") as fh, \
+            ZipFile(fh, "w", compression=ZIP_STORED, allowZip64=True) as zf:
+        # 下载按完成顺序返回，但 ZIP 条目按 URL 输入顺序写入：
+        # 已完成的结果暂存在 results 中，next_write 指向下一个应写入的 idx
+        results = {}  # idx -> BytesIO（失败的为 None，直接跳过）
+        next_write = 0  # 下一个应写入 ZIP 的 idx
+        next_start = 0  # 下一个尚未创建下载任务的 idx
+        in_flight = set()
+
+        def fill_window():
+            """游标前进后，为新进入窗口的条目创建下载任务。"""
+            nonlocal next_start
+            while next_start < len(urls) and next_start < next_write + reorder_window:
+                in_flight.add(asyncio.ensure_future(_fetch(session, urls[next_start], next_start)))
+                next_start += 1
 
-    # 通知前端完成 (done=True)
-    q.put({"items": items.copy(), "done": True})
+        try:
+            fill_window()
+            while in_flight:
+                finished, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                in_flight.difference_update(finished)
+                for task in finished:
+                    idx, _, result = task.result()
+                    if isinstance(result, Exception):
+                        # 失败立即反馈给前端，不必等待前面的条目
+                        item = items[idx]
+                        item["status"] = f"失败: {str(result)}"
+                        item["progress"] = 100
+                        push_update(idx)
+                        result = None
+                    results[idx] = result
+                while next_write in results:
+                    buf = results.pop(next_write)
+                    if buf is not None:
+                        write_entry(zf, next_write, buf)
+                    next_write += 1
+                fill_window()
+        finally:
+            # 异常退出时取消仍在进行的下载，避免任务泄漏
+            for task in in_flight:
+                task.cancel()
+
+def _log_worker_failure(task_id: str, fut):
+    """下载协程的 future 完成回调：记录未被协程内部处理的异常。"""
+    if fut.cancelled():
+        return
+    exc = fut.exception()
+    if exc is not None:
+        app.logger.error("download task %s failed", task_id, exc_info=exc)
 
 # ====== SSE 进度流 ======
+def _sse_frame(data: dict) -> bytes:
+    """编码为一条 SSE data 帧（orjson 直接输出 UTF-8 bytes，不转义非 ASCII）。"""
+    return b"data: " + orjson.dumps(data) + b"\n\n"
+
 @app.route("/progress/<task_id>")
 @login_required
 def progress_stream(task_id):
@@ -252,17 +479,46 @@ def progress_stream(task_id):
     def event_stream():
         q = progress_queues.get(task_id)
         if not q:
-            yield f"data: {json.dumps({'error': 'task not found'})}\n\n"
+            yield _sse_frame({"error": "task not found"})
             return
         while True:
             try:
-                data = q.get(timeout=0.1)
-                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
-                if data.get("done"):
-                    break
+                first = q.get(timeout=SSE_KEEPALIVE_SECONDS)
             except queue.Empty:
+                # 空闲时发送 SSE 注释行保活，防止代理断开连接
+                yield b":keepalive\n\n"
                 continue
 
+            # 取出队列中已积压的全部消息，同一 idx 的 update 只保留最新一条，合并为一帧发送
+            pending = [first]
+            while True:
+                try:
+                    pending.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            merged = {}  # idx -> 最新的 update
+            done = False
+            for data in pending:
+                if data.get("type") == "update":
+                    merged[data["idx"]] = data
+                    continue
+                if merged:
+                    batch = {"type": "batch", "updates": list(merged.values())}
+                    yield _sse_frame(batch)
+                    merged = {}
+                yield _sse_frame(data)
+                if data.get("type") == "done":
+                    done = True
+                    break
+            if done:
+                break
+            if merged:
+                batch = {"type": "batch", "updates": list(merged.values())}
+                yield _sse_frame(batch)
+            # 按固定节奏推送，期间到达的更新会在下一帧合并
+            time.sleep(SSE_FLUSH_INTERVAL)
+
     return Response(event_stream(), mimetype="text/event-stream")
 
 # ====== 启动任务 ======
@@ -278,12 +534,17 @@ def start():
     if not urls:
         return jsonify({"error": "no urls provided"}), 400
 
+    if len(progress_queues) >= MAX_ACTIVE_TASKS:
+        return jsonify({"error": "too many active tasks, please retry later"}), 503
+
     task_id = str(uuid.uuid4())
-    q = queue.Queue()
+    # 合并后每个 idx 最多保留一条 update，再加上 init/done，
+    # 因此队列长度不小于 len(urls) + 2 时终态 update 不会因为队列满而被丢弃
+    q = queue.Queue(maxsize=max(PROGRESS_QUEUE_MAXSIZE, len(urls) + 2))
     progress_queues[task_id] = q
 
-    thread = threading.Thread(target=download_worker, args=(urls, q, task_id), daemon=True)
-    thread.start()
+    fut = asyncio.run_coroutine_threadsafe(_download_worker_async(urls, q, task_id), _download_loop)
+    fut.add_done_callback(functools.partial(_log_worker_failure, task_id))
 
     return jsonify({"task_id": task_id})
 
@@ -294,7 +555,28 @@ def download_final(task_id):
     zip_path = os.path.join(TMP_DIR, f"{task_id}.zip")
     if not os.path.exists(zip_path):
         return "File not found", 404
-    return send_file(zip_path, mimetype="application/zip", as_attachment=True, download_name="images.zip")
+    if USE_XACCEL:
+        # 交给前端 nginx 通过 sendfile 直接发送文件，字节不再经过 Python
+        return Response(status=200, headers={
+            "X-Accel-Redirect": f"{XACCEL_PREFIX}{task_id}.zip",
+            "Content-Disposition": 'attachment; filename="images.zip"',
+            "Content-Type": "application/zip",
+        })
+    # 支持 Range 断点续传和 ETag/Last-Modified 条件请求
+    resp = send_file(
+        zip_path,
+        mimetype="application/zip",
+        as_attachment=True,
+        download_name="images.zip",
+        conditional=True,
+        etag=True,
+        last_modified=os.path.getmtime(zip_path),
+        max_age=60,
+    )
+    # 需要登录才能访问的内容，只允许浏览器缓存，不允许共享代理缓存
+    resp.cache_control.public = False
+    resp.cache_control.private = True
+    return resp
 
 # ====== 主界面（内嵌前端） ======
 HTML_PAGE = r"""
@@ -345,6 +627,14 @@ button:hover{background:#0069d9}
 <script>
 let task_id = null;
 let es = null;
+let items = [];  // 前端维护的进度状态，SSE 只推送增量
+
+function renderItem(it) {
+  const cls = (it.status && it.status.startsWith("完成")) ? "status-ok" :
+              (it.status && it.status.startsWith("失败")) ? "status-fail" : "";
+  return "<b>"+it.name+"</b> - <span class='"+cls+"'>"+(it.status||"")+
+         "</span> ("+(it.progress||0)+"%)";
+}
 
 function appendLog(html) {
   const log = document.getElementById("log");
@@ -360,6 +650,7 @@ function resetUI() {
     es = null;
   }
   task_id = null;
+  items = [];
 }
 
 document.getElementById("startBtn").addEventListener("click", async function(){
@@ -401,24 +692,32 @@ document.getElementById("startBtn").addEventListener("click", async function(){
         es.close();
         return;
       }
-      const items = msg.items || [];
-      const done = !!msg.done;
       const logDiv = document.getElementById("log");
-      logDiv.innerHTML = "";
-      let totalProgress = 0;
-      items.forEach(function(it){
-        totalProgress += (it.progress || 0);
-        const cls = (it.status && it.status.startsWith("完成")) ? "status-ok" :
-                    (it.status && it.status.startsWith("失败")) ? "status-fail" : "";
-        logDiv.insertAdjacentHTML("beforeend",
-          "<div class='item'><b>"+it.name+"</b> - <span class='"+cls+"'>"+(it.status||"")+
-          "</span> ("+(it.progress||0)+"%)</div>");
-      });
+      if (msg.type === "init") {
+        // 仅在开始时整体渲染一次，之后按 idx 增量更新
+        items = msg.items || [];
+        logDiv.innerHTML = "";
+        items.forEach(function(it){
+          logDiv.insertAdjacentHTML("beforeend", "<div class='item'>"+renderItem(it)+"</div>");
+        });
+      } else if (msg.type === "batch") {
+        // 服务端已按 idx 合并的一批增量更新
+        (msg.updates || []).forEach(function(u){
+          const it = items[u.idx];
+          if (!it) return;
+          it.progress = u.progress;
+          it.status = u.status;
+          const row = logDiv.children[u.idx];
+          if (row) row.innerHTML = renderItem(it);
+        });
+      }
       if (items.length) {
+        let totalProgress = 0;
+        items.forEach(function(it){ totalProgress += (it.progress || 0); });
         const percent = Math.floor(totalProgress / items.length);
         document.getElementById("bar").style.width = percent + "%";
       }
-      if (done) {
+      if (msg.type === "done") {
         appendLog("✅ 所有文件已处理，准备打包并提供下载...");
         const a = document.createElement("a");
         a.href = "/download_final/" + task_id;
@@ -442,34 +741,81 @@ document.getElementById("startBtn").addEventListener("click", async function(){
 </html>
 """
 
+# 主界面没有模板变量，导入时编码一次即可
+_INDEX_BYTES = HTML_PAGE.encode("utf-8")
+
 @app.route("/")
 @login_required
 def index():
-    return render_template_string(HTML_PAGE)
+    return _static_html(_INDEX_BYTES)
 
 # ====== 自动清理线程 ======
+def schedule_expiry(delay: float, callback):
+    """登记 delay 秒后执行的清理回调，并唤醒清理线程重新计算下一次唤醒时间。"""
+    with _expiry_cv:
+        heapq.heappush(_expiry_heap, (time.time() + delay, next(_expiry_seq), callback))
+        _expiry_cv.notify()
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except Exception:
+        pass
+
+def _sweep_expired_files():
+    """兜底全量扫描：清理进程重启等原因遗留、未登记到堆中的过期文件。"""
+    now = time.time()
+    try:
+        for fname in os.listdir(TMP_DIR):
+            full = os.path.join(TMP_DIR, fname)
+            if not os.path.isfile(full):
+                continue
+            if now - os.path.getmtime(full) > ZIP_TTL_SECONDS:
+                try:
+                    os.remove(full)
+                except Exception:
+                    pass
+    except Exception:
+        pass
+
 def cleanup_zip_files():
+    """
+    按过期时间最小堆执行清理回调（删除 ZIP、回收任务队列）：空闲时一直阻塞在
+    Condition 上，只在最近的过期时间或兜底扫描时间到达时醒来。启动时先做一次全量扫描。
+    """
+    next_sweep = time.time()
     while True:
-        now = time.time()
-        try:
-            for fname in os.listdir(TMP_DIR):
-                full = os.path.join(TMP_DIR, fname)
-                if not os.path.isfile(full):
-                    continue
-                if now - os.path.getmtime(full) > ZIP_TTL_SECONDS:
-                    try:
-                        os.remove(full)
-                    except Exception:
-                        pass
-        except Exception:
-            pass
-        time.sleep(CLEANUP_INTERVAL)
+        with _expiry_cv:
+            while True:
+                now = time.time()
+                deadline = next_sweep
+                if _expiry_heap:
+                    deadline = min(deadline, _expiry_heap[0][0])
+                if deadline <= now:
+                    break
+                _expiry_cv.wait(timeout=deadline - now)
+            expired = []
+            while _expiry_heap and _expiry_heap[0][0] <= now:
+                expired.append(heapq.heappop(_expiry_heap)[2])
+
+        for callback in expired:
+            try:
+                callback()
+            except Exception:
+                pass
+
+        if now >= next_sweep:
+            _sweep_expired_files()
+            next_sweep = now + CLEANUP_INTERVAL
 
 threading.Thread(target=cleanup_zip_files, daemon=True).start()
 
 # ====== 启动 ======
 if __name__ == "__main__":
-    host = "0.0.0.0"
-    port = int(os.environ.get("PORT", "5000"))
-    print(f"Starting server: http://{host}:{port}")
-    app.run(host=host, port=port, threaded=True)
+    # 交给 gunicorn + gevent worker 运行（配置见 gunicorn_conf.py）
+    here = os.path.dirname(os.path.abspath(__file__))
+    print(f"Starting server via gunicorn: http://0.0.0.0:{os.environ.get('PORT', '5000')}")
+    os.execvp("gunicorn", [
+        "gunicorn", "--chdir", here, "-c", os.path.join(here, "gunicorn_conf.py"),
+        "img_downloader_web_zip_only:app",
+    ])